@@ -4,7 +4,8 @@
 import numpy
 cimport numpy as np
 import cython
-from libc.math cimport log
+from cython.parallel cimport prange
+from libc.math cimport log2, isnan, INFINITY, NAN
 from numpy cimport NPY_FLOAT64 as NPY_float64
 
 @cython.boundscheck(False)
@@ -57,39 +58,201 @@ def split_eq_freq(np.ndarray[np.float64_t, ndim=2] dist not None, int n):
     return points
 
 
+# Below this number of rows, starting threads costs more than it saves
+cdef Py_ssize_t PARALLEL_MIN_ROWS = 500
+
+# Table of log2 of small integers; class counts are mostly small integers
+cdef enum:
+    LOG2_TABLE_SIZE = 65536
+cdef double LOG2_TABLE[LOG2_TABLE_SIZE]
+
+
+cdef void _init_log2_table():
+    cdef Py_ssize_t i
+    LOG2_TABLE[0] = -INFINITY
+    for i in range(1, LOG2_TABLE_SIZE):
+        LOG2_TABLE[i] = log2(<double>i)
+
+_init_log2_table()
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline double _log2(double t) nogil:
+    """log2 that looks up values for small non-negative integers"""
+    if t < LOG2_TABLE_SIZE and t == <Py_ssize_t>t:
+        return LOG2_TABLE[<Py_ssize_t>t]
+    return log2(t)
+
+
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def entropy_normalized1(np.ndarray[np.float64_t, ndim=1] D):
+@cython.cdivision(True)
+def entropy_counts1(const double[:] D):
     """
-    Compute entropy of distribution in `D` (must be normalized).
+    Compute entropy of distribution given by (unnormalized) counts in `D`.
     """
-    cdef np.float64_t R = 0.
+    cdef double s = 0., R = 0., ls, t
     cdef Py_ssize_t j
-    cdef np.float64_t t
-    cdef np.float64_t log2 = 1./log(2.)
-    for j in range(D.shape[0]):
-        t = D[j]
-        if t > 0.:
-            if t > 1.0: t = 1.0
-            R -= t*log(t)*log2
+    with nogil:
+        for j in range(D.shape[0]):
+            if D[j] > 0.:
+                s += D[j]
+        if s > 0.:
+            # H = sum(c * (log2(s) - log2(c))) / s; each term is
+            # non-negative and pure distributions give exactly 0
+            ls = _log2(s)
+            for j in range(D.shape[0]):
+                t = D[j]
+                if t > 0.:
+                    R += t * (ls - _log2(t))
+            R /= s
     return R
 
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def entropy_normalized2(np.ndarray[np.float64_t, ndim=2] D):
+@cython.cdivision(True)
+cdef inline double _entropy_counts_row(const double[:, :] D,
+                                       Py_ssize_t i) nogil:
+    cdef Py_ssize_t j
+    cdef double s = 0., r = 0., ls, t
+    for j in range(D.shape[1]):
+        if D[i, j] > 0.:
+            s += D[i, j]
+    if s == 0.:
+        return 0.
+    ls = _log2(s)
+    for j in range(D.shape[1]):
+        t = D[i, j]
+        if t > 0.:
+            r += t * (ls - _log2(t))
+    return r / s
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def entropy_counts2(const double[:, :] D):
     """
-    Compute entropy of distributions in `D`.
-    Rows in `D` must be a distribution (i.e. sum to 1.0 over `axis`).
+    Compute entropy of distributions given by (unnormalized) counts in
+    rows of `D`.
+
+    Rows are processed in parallel if the module is compiled with OpenMP.
     """
-    cdef np.ndarray[np.float64_t, ndim=1] R = numpy.zeros(D.shape[0])
-    cdef Py_ssize_t i,j
-    cdef np.float64_t t
-    cdef np.float64_t log2 = 1./log(2.)
-    for i in range(D.shape[0]):
-        for j in range(D.shape[1]):
-            t = D[i,j]
-            if t > 0.:
-                if t > 1.0: t = 1.0
-                R[i] -= t*log(t)*log2
-    return R
+    cdef np.ndarray[np.float64_t, ndim=1] R_arr = numpy.zeros(D.shape[0])
+    cdef double[::1] R = R_arr
+    cdef Py_ssize_t i, n = D.shape[0]
+    if n < PARALLEL_MIN_ROWS:
+        with nogil:
+            for i in range(n):
+                R[i] = _entropy_counts_row(D, i)
+    else:
+        for i in prange(n, nogil=True, schedule="static"):
+            R[i] = _entropy_counts_row(D, i)
+    return R_arr
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef inline double _count_diff(const double[:, :] cumC,
+                               Py_ssize_t a, Py_ssize_t b) nogil:
+    cdef Py_ssize_t j
+    cdef double s = 0.
+    for j in range(cumC.shape[1]):
+        s += cumC[a, j] - cumC[b, j]
+    return s
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+cdef inline double _entropy_diff(const double[:, :] cumC,
+                                 Py_ssize_t a, Py_ssize_t b, double s) nogil:
+    cdef Py_ssize_t j
+    cdef double r = 0., ls, t
+    if s <= 0.:
+        return 0.
+    ls = _log2(s)
+    for j in range(cumC.shape[1]):
+        t = cumC[a, j] - cumC[b, j]
+        if t > 0.:
+            r += t * (ls - _log2(t))
+    return r / s
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+def entropy_cuts(const double[:, :] cumC, Py_ssize_t lo, Py_ssize_t hi):
+    """
+    Compute the class information entropy of all cuts of rows `lo:hi` of
+    distribution `C`, given cumulative counts `cumC`, where `cumC[i]` is the
+    sum of the first `i` rows of `C`.
+
+    Return arrays `E`, `ES1` and `ES2` with the entropy of the partition
+    and of the left and right subset for the cut before each of rows
+    `lo + 1:hi`.
+    """
+    cdef Py_ssize_t n = max(hi - lo - 1, 0)
+    cdef np.ndarray[np.float64_t, ndim=1] E_arr = numpy.zeros(n)
+    cdef np.ndarray[np.float64_t, ndim=1] ES1_arr = numpy.zeros(n)
+    cdef np.ndarray[np.float64_t, ndim=1] ES2_arr = numpy.zeros(n)
+    cdef double[::1] E = E_arr, ES1 = ES1_arr, ES2 = ES2_arr
+    cdef Py_ssize_t i, c
+    cdef double n1, n2, S_count
+
+    if n == 0:
+        return E_arr, ES1_arr, ES2_arr
+    S_count = _count_diff(cumC, hi, lo)
+    if n < PARALLEL_MIN_ROWS:
+        with nogil:
+            for i in range(n):
+                c = lo + 1 + i
+                n1 = _count_diff(cumC, c, lo)
+                n2 = _count_diff(cumC, hi, c)
+                ES1[i] = _entropy_diff(cumC, c, lo, n1)
+                ES2[i] = _entropy_diff(cumC, hi, c, n2)
+                E[i] = ES1[i] * n1 / S_count + ES2[i] * n2 / S_count
+    else:
+        for i in prange(n, nogil=True, schedule="static"):
+            c = lo + 1 + i
+            n1 = _count_diff(cumC, c, lo)
+            n2 = _count_diff(cumC, hi, c)
+            ES1[i] = _entropy_diff(cumC, c, lo, n1)
+            ES2[i] = _entropy_diff(cumC, hi, c, n2)
+            E[i] = ES1[i] * n1 / S_count + ES2[i] * n2 / S_count
+    return E_arr, ES1_arr, ES2_arr
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def digitize_nan(const double[::1] c, const double[::1] points,
+                 double[::1] out):
+    """
+    Put the index of bin for each value in `c` into `out`. Values equal to
+    a threshold belong to the upper bin (as in `numpy.digitize`); nans stay
+    nans. `points` must be increasing.
+    """
+    cdef Py_ssize_t i, lo, hi, mid
+    cdef Py_ssize_t n = c.shape[0], k = points.shape[0]
+    cdef double x
+    with nogil:
+        for i in range(n):
+            x = c[i]
+            if isnan(x):
+                out[i] = NAN
+                continue
+            if k <= 8:
+                # linear scan is faster for the usual small number of bins
+                lo = 0
+                while lo < k and points[lo] <= x:
+                    lo += 1
+            else:
+                lo, hi = 0, k
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if points[mid] <= x:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+            out[i] = lo
@@ -4,12 +4,19 @@ import time
 from numbers import Number
 from typing import NamedTuple, List, Union, Callable, Optional
 import datetime
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 from itertools import count
 
 import numpy as np
 import scipy.sparse as sp
 
-from Orange.data import DiscreteVariable, Domain, TimeVariable, Table
+from Orange.data import \
+    ContinuousVariable, DiscreteVariable, Domain, TimeVariable, Table
 from Orange.data.sql.table import SqlTable
 from Orange.statistics import distribution, contingency, util as ut
 from Orange.statistics.basic_stats import BasicStats
@@ -27,7 +34,7 @@ class Discretizer(Transformation):
     """
     def __init__(self, variable, points):
         super().__init__(variable)
-        self.points = points
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
 
     @staticmethod
     def digitize(x, bins):
@@ -44,22 +51,24 @@ class Discretizer(Transformation):
         if sp.issparse(c):
             return self.digitize(c, self.points)
         elif c.size:
-            return np.where(np.isnan(c), np.NaN, self.digitize(c, self.points))
+            if c.dtype == np.float64 and c.ndim == 1 \
+                    and c.flags.c_contiguous:
+                out = np.empty(len(c))
+                _discretize.digitize_nan(
+                    c, np.ascontiguousarray(self.points, dtype=np.float64),
+                    out)
+                return out
+            # For increasing bins, searchsorted(side="right") equals digitize;
+            # nans are sorted to the end and then overwritten in place
+            out = np.searchsorted(self.points, c, side="right").astype(float)
+            if c.dtype.kind == "f":
+                out[np.isnan(c)] = np.nan
+            return out
         else:
             return np.array([], dtype=int)
 
     @staticmethod
-    def _fmt_interval(low, high, formatter):
-        assert low is not None or high is not None
-        assert low is None or high is None or low < high
-        if low is None or np.isinf(low):
-            return f"< {formatter(high)}"
-        if high is None or np.isinf(high):
-            return f"≥ {formatter(low)}"
-        return f"{formatter(low)} - {formatter(high)}"
-
-    @classmethod
-    def create_discretized_var(cls, var, points, ndigits=None):
+    def _formatter(var, ndigits=None):
         if ndigits is None:
             def fmt(val):
                 sval = var.str_val(val)
@@ -68,33 +77,76 @@ class Discretizer(Transformation):
                     return sval.rstrip("0").rstrip(".")
                 return sval
         else:
+            spec = f".{ndigits}f"
+
             def fmt(val):
-                return f"{val:.{ndigits}f}"
+                return format(val, spec)
+        return fmt
+
+    @staticmethod
+    def _interval_labels(points, fmt):
+        # Points are finite and increasing, so only the first and the last
+        # interval are open; each point is formatted just once
+        labels = [fmt(x) for x in points]
+        return [f"< {labels[0]}"] \
+            + [f"{low} - {high}" for low, high in zip(labels, labels[1:])] \
+            + [f"≥ {labels[-1]}"]
 
-        lpoints = list(points)
+    @classmethod
+    def create_discretized_var(cls, var, points, ndigits=None):
+        discretizer = cls(var, points)
+        lpoints = discretizer.points.tolist()
         if lpoints:
-            values = [
-                cls._fmt_interval(low, high, fmt)
-                for low, high in zip([-np.inf] + lpoints, lpoints + [np.inf])]
+            # Labels of ContinuousVariable depend only on its decimals and
+            # format, so they can be cached; subclasses (e.g. TimeVariable)
+            # may format values differently and are formatted every time
+            if ndigits is not None:
+                values = _cached_interval_labels(
+                    tuple(lpoints), ndigits, None, None)
+            elif type(var) is ContinuousVariable:
+                values = _cached_interval_labels(
+                    tuple(lpoints), None,
+                    var.number_of_decimals, var.format_str)
+            else:
+                values = cls._interval_labels(
+                    lpoints, cls._formatter(var, ndigits))
             to_sql = BinSql(var, lpoints)
         else:
             values = ["single_value"]
             to_sql = SingleValueSql(values[0])
 
         dvar = DiscreteVariable(name=var.name, values=values,
-                                compute_value=cls(var, points),
+                                compute_value=discretizer,
                                 sparse=var.sparse)
         dvar.source_variable = var
         dvar.to_sql = to_sql
         return dvar
 
     def __eq__(self, other):
-        return super().__eq__(other) and self.points == other.points
+        return super().__eq__(other) \
+            and np.array_equal(self.points, other.points)
 
     def __hash__(self):
         return hash((type(self), self.variable, tuple(self.points)))
 
 
+@lru_cache(maxsize=1024)
+def _cached_interval_labels(points, ndigits, number_of_decimals, format_str):
+    """
+    Return interval labels for a ContinuousVariable with the given number of
+    decimals and format string, or for the given `ndigits`.
+    """
+    var = None
+    if ndigits is None:
+        # The name does not affect formatting; any variable with the same
+        # decimals and format produces the same labels
+        var = ContinuousVariable("x")
+        var.number_of_decimals = number_of_decimals
+        var.format_str = format_str
+    fmt = Discretizer._formatter(var, ndigits)
+    return tuple(Discretizer._interval_labels(list(points), fmt))
+
+
 class BinSql:
     def __init__(self, var, points):
         self.var = var
@@ -113,6 +165,122 @@ class SingleValueSql:
         return "'%s'" % self.value
 
 
+# Maximal number of discretized variables kept for each data table
+_DATA_CACHE_SIZE = 64
+
+
+class _DataCache:
+    """
+    Points of discretizations computed on a data table.
+
+    Checksums of class values and weights are kept only while a `batch`
+    of variables is discretized; single calls compute them again, since
+    the table may be changed in place in between.
+    """
+    def __init__(self):
+        self.points = OrderedDict()
+        self.table_checksums = {}
+        self.batches = 0
+
+
+# Tables are held by weak references, so their entries are removed when
+# tables are garbage collected. Discretizations may be computed in worker
+# threads, hence the lock.
+_data_cache = weakref.WeakKeyDictionary()
+_data_cache_lock = threading.Lock()
+
+
+def _checksum(arrays):
+    checksum = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+        if sp.issparse(arr):
+            arr = arr.tocsr()
+            parts = (arr.data, arr.indices, arr.indptr)
+        else:
+            parts = (arr, )
+        for part in parts:
+            part = np.ascontiguousarray(part, dtype=np.float64)
+            checksum.update(str(part.shape).encode())
+            checksum.update(part.view(np.uint8))
+    return checksum.digest()
+
+
+def _table_checksum(data, use_class):
+    """
+    Return a checksum of the weights and, if `use_class` is set, of the
+    class values of `data`.
+    """
+    arrays = []
+    if use_class:
+        arrays.append(data._Y)  # pylint: disable=protected-access
+    if data.has_weights():
+        arrays.append(data.W)
+    return _checksum(arrays)
+
+
+@contextmanager
+def _reuse_table_checksums(data):
+    """Reuse checksums of class values and weights within the context."""
+    if type(data) == SqlTable:
+        yield
+        return
+    with _data_cache_lock:
+        entry = _data_cache.setdefault(data, _DataCache())
+        entry.batches += 1
+    try:
+        yield
+    finally:
+        with _data_cache_lock:
+            entry.batches -= 1
+            if not entry.batches:
+                entry.table_checksums.clear()
+
+
+def _cached_per_data(use_class=False):
+    """
+    Decorate `__call__` of a discretization to reuse the points computed
+    for the same data table, variable and discretization parameters.
+
+    Points are keyed by checksums of the column, the weights and, if
+    `use_class` is set, the class values, so changes of tables in place
+    are taken into account. Each call returns a new variable. Calls with
+    extra arguments and calls on SQL tables are not cached.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapped(self, data, attribute, *args, **kwargs):
+            if args or kwargs or type(data) == SqlTable:
+                return func(self, data, attribute, *args, **kwargs)
+            var = data.domain[attribute]
+            column_checksum = _checksum([data.get_column(attribute)])
+            with _data_cache_lock:
+                entry = _data_cache.setdefault(data, _DataCache())
+                table_checksum = entry.table_checksums.get(use_class)
+            if table_checksum is None:
+                table_checksum = _table_checksum(data, use_class)
+                with _data_cache_lock:
+                    if entry.batches:
+                        entry.table_checksums[use_class] = table_checksum
+            key = (repr(self), var, column_checksum, table_checksum)
+            with _data_cache_lock:
+                points = entry.points.get(key)
+                if points is not None:
+                    entry.points.move_to_end(key)
+            if points is not None:
+                return Discretizer.create_discretized_var(var, points.copy())
+
+            dvar = func(self, data, attribute)
+            with _data_cache_lock:
+                entry.points[key] = dvar.compute_value.points.copy()
+                if len(entry.points) > _DATA_CACHE_SIZE:
+                    entry.points.popitem(last=False)
+            return dvar
+
+        return wrapped
+
+    return decorator
+
+
 class Discretization(Reprable):
     """Abstract base class for discretization classes."""
     def __call__(self, data, variable):
@@ -126,6 +294,16 @@ class Discretization(Reprable):
             "Subclasses of 'Discretization' need to implement "
             "the call operator")
 
+    def batch(self, data, variables):
+        """
+        Compute discretizations of the given variables on the given data.
+        Return a list of new variables, one for each variable.
+
+        Subclasses may override this to share work between variables.
+        """
+        with _reuse_table_checksums(data):
+            return [self(data, var) for var in variables]
+
 
 class EqualFreq(Discretization):
     """Discretization into bins with approximately equal number of data
@@ -140,14 +318,15 @@ class EqualFreq(Discretization):
         self.n = n
 
     # noinspection PyProtectedMember
+    @_cached_per_data()
     def __call__(self, data, attribute):
         if type(data) == SqlTable:
             att = attribute.to_sql()
-            quantiles = [(i + 1) / self.n for i in range(self.n - 1)]
+            quantiles = (np.arange(1, self.n) / self.n).tolist()
             query = data._sql_query(
-                ['quantile(%s, ARRAY%s)' % (att, str(quantiles))],
+                ['quantile(%s, ARRAY%s)' % (att, quantiles)],
                 use_time_sample=1000)
-            with data._execute_sql_query(query) as cur:
+            with data.backend.execute_sql_query(query) as cur:
                 points = sorted(set(cur.fetchone()[0]))
         else:
             d = distribution.get_distribution(data, attribute)
@@ -186,11 +365,26 @@ class EqualWidth(Discretization):
         return Discretizer.create_discretized_var(
             data.domain[attribute], points)
 
+    def batch(self, data, variables):
+        attrs = data.domain.attributes
+        indices = [data.domain.index(var) for var in variables]
+        if type(data) == SqlTable or not len(data) or not variables \
+                or not all(0 <= i < len(attrs) for i in indices):
+            return super().batch(data, variables)
+        # A single column-wise pass over the requested columns of X instead
+        # of one per variable
+        X = data.X[:, indices]
+        mns, mxs = ut.nanmin(X, axis=0), ut.nanmax(X, axis=0)
+        return [
+            Discretizer.create_discretized_var(
+                attrs[i], self._split_eq_width(mn, mx))
+            for i, mn, mx in zip(indices, mns, mxs)]
+
     def _split_eq_width(self, mn, mx):
         if np.isnan(mn) or np.isnan(mx) or mn == mx:
             return []
         dif = (mx - mn) / self.n
-        return [mn + i * dif for i in range(1, self.n)]
+        return mn + dif * np.arange(1, self.n, dtype=np.float64)
 
 
 class TooManyIntervals(ValueError):
@@ -330,7 +524,7 @@ class Binning(Discretization):
             f"{lab1} - {lab2}" for lab1, lab2 in zip(blabels, blabels[1:])
         ] + [f"≥ {blabels[-1]}"]
 
-        discretizer = Discretizer(variable, list(binning.thresholds[1:-1]))
+        discretizer = Discretizer(variable, binning.thresholds[1:-1])
         dvar = DiscreteVariable(name=variable.name, values=labels,
                                 compute_value=discretizer,
                                 sparse=variable.sparse)
@@ -640,6 +834,17 @@ short_time_units = dict(seconds="sec", minutes="min", hours="hrs",
                         second="sec", minute="min", month="mon")
 
 
+# log2(3 ** k - 2) for k = 1, ..., 32 (the number of classes in MDL criterion)
+_LOG2_3POW_M2 = np.log2(3.0 ** np.arange(1, 33) - 2)
+
+
+def _log2_3pow_m2(k):
+    if k <= len(_LOG2_3POW_M2):
+        return _LOG2_3POW_M2[int(k) - 1]
+    # 2 is negligible relative to 3 ** k; this also avoids overflow
+    return k * np.log2(3)
+
+
 # noinspection PyPep8Naming
 class EntropyMDL(Discretization):
     """
@@ -660,6 +865,7 @@ class EntropyMDL(Discretization):
     def __init__(self, force=False):
         self.force = force
 
+    @_cached_per_data(use_class=True)
     def __call__(self, data, attribute):
         cont = contingency.get_contingency(data, attribute)
         values, I = cont.values, cont.counts.T
@@ -723,8 +929,11 @@ class EntropyMDL(Discretization):
         D = np.asarray(D)
         if np.sum(D) == 0:
             return 0
+        # One temporary array for clipped values, their logs and products
         Dc = np.clip(D, np.finfo(D.dtype).eps, 1.0)
-        return - np.sum(D * np.log2(Dc), axis=axis)
+        np.log2(Dc, out=Dc)
+        Dc *= D
+        return - np.sum(Dc, axis=axis)
 
     @classmethod
     def _entropy(cls, D, axis=None):
@@ -739,64 +948,45 @@ class EntropyMDL(Discretization):
             Axis of `D` along which to compute the entropy.
 
         """
-        D = cls._normalize(D, axis=axis)
+        D = np.array(D, dtype=float)
+        D = cls._normalize(D, axis=axis, out=D)
         return cls._entropy_normalized(D, axis=axis)
 
     @classmethod
     def _entropy1(cls, D):
         """
-        Compute the entropy of distributions in `D`
-        (one per each row).
+        Compute the entropy of distribution given by counts in `D`.
         """
-        D = cls._normalize(D)
-        return _discretize.entropy_normalized1(D)
+        return _discretize.entropy_counts1(np.asarray(D, dtype=float))
 
     @classmethod
     def _entropy2(cls, D):
         """
-        Compute the entropy of distributions in `D`
+        Compute the entropy of distributions given by counts in `D`
         (one per each row).
         """
-        D = cls._normalize(D, axis=1)
-        return _discretize.entropy_normalized2(D)
+        return _discretize.entropy_counts2(np.asarray(D, dtype=float))
 
     @classmethod
-    def _entropy_cuts_sorted(cls, CS):
+    def _entropy_cuts_sorted_range(cls, cumC, lo, hi):
         """
         Return the class information entropy induced by partitioning
-        the `CS` distribution at all N-1 candidate cut points.
+        the distribution `C[lo:hi]` at all candidate cut points.
 
         Parameters
         ----------
-        CS : (N, K) array of class distributions.
+        cumC : (N + 1, K) array of cumulative class distributions, such
+            that `cumC[i]` is the sum of the first `i` rows of `C`.
+        lo, hi : int
+            Range of rows of `C` to partition.
         """
-        CS = np.asarray(CS)
         # |--|-------|--------|
         #  S1    ^       S2
         # S1 contains all points which are <= to cut point
-        # Cumulative distributions for S1 and S2 (left right set)
-        # i.e. a cut at index i separates the CS into S1Dist[i] and S2Dist[i]
-        S1Dist = np.cumsum(CS, axis=0)[:-1]
-        S2Dist = np.cumsum(CS[::-1], axis=0)[-2::-1]
-
-        # Entropy of S1[i] and S2[i] sets
-        ES1 = cls._entropy2(S1Dist)
-        ES2 = cls._entropy2(S2Dist)
-
-        # Number of cases in S1[i] and S2[i] sets
-        S1_count = np.sum(S1Dist, axis=1)
-        S2_count = np.sum(S2Dist, axis=1)
-
-        # Number of all cases
-        S_count = np.sum(CS)
-
-        ES1w = ES1 * S1_count / S_count
-        ES2w = ES2 * S2_count / S_count
-
-        # E(A, T; S) Class information entropy of the partition S
-        E = ES1w + ES2w
-
-        return E, ES1, ES2
+        # A cut at index i separates C[lo:hi] into S1 = C[lo:lo + i + 1]
+        # and S2 = C[lo + i + 1:hi]; their distributions are differences
+        # of the shared cumulative sums and are computed on the fly
+        return _discretize.entropy_cuts(cumC, lo, hi)
 
     @classmethod
     def _entropy_discretize_sorted(cls, C, force=False):
@@ -806,41 +996,70 @@ class EntropyMDL(Discretization):
         :param C: (N, K) array of class distributions.
 
         """
-        E, ES1, ES2 = cls._entropy_cuts_sorted(C)
-        # TODO: Also get the left right distribution counts from
-        # entropy_cuts_sorted,
+        C = np.asarray(C, dtype=float)
+        # Cumulative sums are computed once and shared by all recursion
+        # levels. They are stored by classes (K, N + 1), so that each class
+        # is summed over contiguous memory (C usually comes as a transposed
+        # (K, N) contingency); cumC is a (N + 1, K) view
+        cumC_T = np.zeros((C.shape[1], C.shape[0] + 1))
+        np.cumsum(C.T, axis=1, out=cumC_T[:, 1:])
+        cumC = cumC_T.T
+        return cls._entropy_discretize_sorted_range(cumC, 0, len(C), force)
+
+    @classmethod
+    def _entropy_discretize_sorted_range(cls, cumC, lo, hi, force=False):
+        """
+        Entropy discretization of rows `lo:hi` of a sorted C, given its
+        cumulative sums `cumC` (see `_entropy_cuts_sorted_range`).
 
+        Returned cut indices are relative to `lo`.
+        """
         # Note the + 1
-        if len(E) == 0:
+        if hi - lo <= 1:
             return []
+
+        # Distribution of classes in S, its entropy, number of different
+        # classes and number of cases
+        S_c = cumC[hi] - cumC[lo]
+        k = float(np.sum(S_c > 0))
+        N = float(np.sum(S_c))
+        assert k > 0
+        ES = cls._entropy1(S_c)
+        if not force:
+            # Reject without computing the cuts if the split can't pass
+            # the MDL criterion: Gain <= ES and
+            # delta >= log2(3 ** k - 2) - k * ES
+            if k == 1 or N <= 1:
+                return []
+            if ES * (N + k) <= np.log2(N - 1) + _log2_3pow_m2(k) - 1e-9:
+                return []
+
+        E, ES1, ES2 = cls._entropy_cuts_sorted_range(cumC, lo, hi)
         cut_index = np.argmin(E) + 1
 
-        # Distribution of classed in S1, S2 and S
-        S1_c = np.sum(C[:cut_index], axis=0)
-        S2_c = np.sum(C[cut_index:], axis=0)
-        S_c = S1_c + S2_c
+        # Distribution of classes in S1 and S2
+        S1_c = cumC[lo + cut_index] - cumC[lo]
+        S2_c = cumC[hi] - cumC[lo + cut_index]
 
-        ES = cls._entropy1(np.sum(C, axis=0))
         ES1, ES2 = ES1[cut_index - 1], ES2[cut_index - 1]
 
         # Information gain of the best split
         Gain = ES - E[cut_index - 1]
-        # Number of different classes in S, S1 and S2
-        k = float(np.sum(S_c > 0))
+        # Number of different classes in S1 and S2
         k1 = float(np.sum(S1_c > 0))
         k2 = float(np.sum(S2_c > 0))
 
-        assert k > 0
-        delta = np.log2(3 ** k - 2) - (k * ES - k1 * ES1 - k2 * ES2)
-        N = float(np.sum(S_c))
+        delta = _log2_3pow_m2(k) - (k * ES - k1 * ES1 - k2 * ES2)
 
         if N > 1 and Gain > np.log2(N - 1) / N + delta / N:
             # Accept the cut point and recursively split the subsets.
             left, right = [], []
             if k1 > 1 and cut_index > 1:
-                left = cls._entropy_discretize_sorted(C[:cut_index, :])
-            if k2 > 1 and cut_index < len(C) - 1:
-                right = cls._entropy_discretize_sorted(C[cut_index:, :])
+                left = cls._entropy_discretize_sorted_range(
+                    cumC, lo, lo + cut_index)
+            if k2 > 1 and cut_index < hi - lo - 1:
+                right = cls._entropy_discretize_sorted_range(
+                    cumC, lo + cut_index, hi)
             return left + [cut_index] + [i + cut_index for i in right]
         elif force:
             return [cut_index]
@@ -885,13 +1104,22 @@ class DomainDiscretizer(Reprable):
         """
 
         def transform_list(s, fixed=None):
+            fixed = fixed or {}
+            to_batch = [var for var in s
+                        if var.is_continuous and var.name not in fixed]
+            if isinstance(method, Discretization):
+                batched = method.batch(data, to_batch)
+            else:
+                batched = [method(data, var) for var in to_batch]
+            batched = dict(zip((var.name for var in to_batch), batched))
+
             new_vars = []
             for var in s:
                 if var.is_continuous:
-                    if fixed and var.name in fixed.keys():
+                    if var.name in fixed:
                         nv = method(data, var, fixed)
                     else:
-                        nv = method(data, var)
+                        nv = batched[var.name]
                     if not self.clean or len(nv.values) > 1:
                         new_vars.append(nv)
                 else:
@@ -902,6 +1130,14 @@ class DomainDiscretizer(Reprable):
         else:
             method = self.method
         domain = data.domain
+        if not any(var.is_continuous for var in domain.attributes) and not (
+                self.discretize_class
+                and any(var.is_continuous for var in domain.class_vars)):
+            # nothing to discretize; the result would equal the input
+            # domain without metas, so reuse it if it has none
+            if not domain.metas:
+                return domain
+            return Domain(domain.attributes, domain.class_vars)
         new_attrs = transform_list(domain.attributes, fixed or self.fixed)
         if self.discretize_class:
             new_classes = transform_list(domain.class_vars)
@@ -275,7 +275,7 @@ class TestBinningDiscretizer(unittest.TestCase):
     def test_no_data(self):
         no_data = Table(Domain([ContinuousVariable("y")]), np.zeros((0, 1)))
         dvar = Binning()(no_data, 0)
-        self.assertEqual(dvar.compute_value.points, [])
+        np.testing.assert_equal(dvar.compute_value.points, [])
 
     @patch("Orange.preprocess.discretize.time_binnings")
     @patch("Orange.preprocess.discretize.decimal_binnings")
@@ -300,10 +300,10 @@ class TestBinningDiscretizer(unittest.TestCase):
         create = discretize._create_binned_var
 
         binnings = []
-        self.assertEqual(create(binnings, var).compute_value.points, [])
+        np.testing.assert_equal(create(binnings, var).compute_value.points, [])
 
         binnings = None
-        self.assertEqual(create(binnings, var).compute_value.points, [])
+        np.testing.assert_equal(create(binnings, var).compute_value.points, [])
 
         binnings = [
             BinDefinition(np.arange(i + 1),
@@ -1,16 +1,21 @@
 # Test methods with long descriptive names can omit docstrings
 # pylint: disable=missing-docstring
 
+import gc
 import sys
 import random
+import warnings
+import weakref
 from unittest import TestCase
+from unittest.mock import patch
 
 import numpy as np
 import scipy.sparse as sp
 
 from Orange.preprocess import discretize, Discretize, decimal_binnings
 from Orange import data
-from Orange.data import Table, Instance, Domain, ContinuousVariable, DiscreteVariable
+from Orange.data import Table, Instance, Domain, ContinuousVariable, \
+    DiscreteVariable, TimeVariable
 
 
 # noinspection PyPep8Naming
@@ -26,7 +31,7 @@ class TestEqualFreq(TestCase):
         disc = discretize.EqualFreq(n=4)
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 2)
-        self.assertEqual(dvar.compute_value.points, [0.5])
+        np.testing.assert_equal(dvar.compute_value.points, [0.5])
 
     def test_equifreq_100_to_4(self):
         X = np.arange(100).reshape((100, 1))
@@ -34,7 +39,7 @@ class TestEqualFreq(TestCase):
         disc = discretize.EqualFreq(n=4)
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 4)
-        self.assertEqual(dvar.compute_value.points, [24.5, 49.5, 74.5])
+        np.testing.assert_equal(dvar.compute_value.points, [24.5, 49.5, 74.5])
 
     def test_equifreq_with_k_instances(self):
         X = np.array([[1], [2], [3], [4]])
@@ -42,7 +47,7 @@ class TestEqualFreq(TestCase):
         disc = discretize.EqualFreq(n=4)
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 4)
-        self.assertEqual(dvar.compute_value.points, [1.5, 2.5, 3.5])
+        np.testing.assert_equal(dvar.compute_value.points, [1.5, 2.5, 3.5])
 
     def test_below_precision(self):
         eps = sys.float_info.epsilon
@@ -75,7 +80,7 @@ class TestEqualWidth(TestCase):
         disc = discretize.EqualWidth(n=4)
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 4)
-        self.assertEqual(dvar.compute_value.points, [0.25, 0.5, 0.75])
+        np.testing.assert_equal(dvar.compute_value.points, [0.25, 0.5, 0.75])
 
     @table_dense_sparse
     def test_equalwidth_100_to_4(self, prepare_table):
@@ -84,7 +89,34 @@ class TestEqualWidth(TestCase):
         disc = discretize.EqualWidth(n=4)
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 4)
-        self.assertEqual(dvar.compute_value.points, [25, 50, 75])
+        np.testing.assert_equal(dvar.compute_value.points, [25, 50, 75])
+
+    @table_dense_sparse
+    def test_batch(self, prepare_table):
+        X = np.array([np.arange(101), np.ones(101), np.full(101, np.nan),
+                      np.arange(101) % 7 - 3]).T
+        X[[5, 15], 0] = np.nan
+        table = prepare_table(data.Table.from_numpy(None, X))
+        disc = discretize.EqualWidth(n=4)
+        attrs = table.domain.attributes
+        dvars = disc.batch(table, [attrs[3], attrs[0], attrs[1], attrs[2]])
+        for dvar, attr in zip(dvars, [attrs[3], attrs[0], attrs[1], attrs[2]]):
+            expected = disc(table, attr)
+            self.assertEqual(dvar.name, attr.name)
+            self.assertEqual(dvar.values, expected.values)
+            np.testing.assert_equal(dvar.compute_value.points,
+                                    expected.compute_value.points)
+        self.assertEqual(disc.batch(table, []), [])
+
+    def test_batch_skips_other_columns(self):
+        domain = Domain([DiscreteVariable("d", values=("a", "b")),
+                         ContinuousVariable("c")])
+        X = np.array([[np.nan, 0], [np.nan, 4]])
+        table = data.Table.from_numpy(domain, X)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            dvar, = discretize.EqualWidth(n=4).batch(table, [domain[1]])
+        np.testing.assert_equal(dvar.compute_value.points, [1, 2, 3])
 
     def test_equalwidth_const_value(self):
         X = np.ones((100, 1))
@@ -92,7 +124,7 @@ class TestEqualWidth(TestCase):
         disc = discretize.EqualFreq(n=4)
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 1)
-        self.assertEqual(dvar.compute_value.points, [])
+        np.testing.assert_equal(dvar.compute_value.points, [])
 
 
 class TestBinning(TestCase):
@@ -133,7 +165,7 @@ class TestEntropyMDL(TestCase):
         disc = discretize.EntropyMDL()
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 2)
-        self.assertEqual(dvar.compute_value.points, [0.5])
+        np.testing.assert_equal(dvar.compute_value.points, [0.5])
 
     def test_entropy_with_two_values_useless(self):
         X = np.array([0] * 50 + [1] * 50).reshape((100, 1))
@@ -142,7 +174,7 @@ class TestEntropyMDL(TestCase):
         disc = discretize.EntropyMDL()
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 1)
-        self.assertEqual(dvar.compute_value.points, [])
+        np.testing.assert_equal(dvar.compute_value.points, [])
 
     def test_entropy_constant(self):
         X = np.zeros((100, 1))
@@ -152,7 +184,7 @@ class TestEntropyMDL(TestCase):
         disc = discretize.EntropyMDL()
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 1)
-        self.assertEqual(dvar.compute_value.points, [])
+        np.testing.assert_equal(dvar.compute_value.points, [])
 
     def test_entropy(self):
         X = np.array([0] * 25 + [1] * 25 + [2] * 25 + [3] * 25
@@ -162,7 +194,166 @@ class TestEntropyMDL(TestCase):
         disc = discretize.EntropyMDL()
         dvar = disc(table, table.domain[0])
         self.assertEqual(len(dvar.values), 2)
-        self.assertEqual(dvar.compute_value.points, [0.5])
+        np.testing.assert_equal(dvar.compute_value.points, [0.5])
+
+    def test_entropy_from_counts(self):
+        D = np.array([[0, 0, 0], [5, 0, 0], [1, 1, 0], [1, 2, 3]])
+        P = D[3] / 6
+        expected = [0, 0, 1, -np.sum(P * np.log2(P))]
+        np.testing.assert_almost_equal(
+            discretize.EntropyMDL._entropy2(D), expected)
+        for d, e in zip(D, expected):
+            self.assertAlmostEqual(discretize.EntropyMDL._entropy1(d), e)
+        # Pure distributions have exactly zero entropy
+        self.assertEqual(discretize.EntropyMDL._entropy2(D)[1], 0)
+
+        # Counts outside the table of logarithms: large and weighted
+        D = np.array([[70000, 1], [0.5, 2.25], [70000, 0]])
+        P = D / D.sum(axis=1, keepdims=True)
+        expected = [-np.sum(p[p > 0] * np.log2(p[p > 0])) for p in P]
+        np.testing.assert_almost_equal(
+            discretize.EntropyMDL._entropy2(D), expected)
+        for d, e in zip(D, expected):
+            self.assertAlmostEqual(discretize.EntropyMDL._entropy1(d), e)
+        self.assertEqual(discretize.EntropyMDL._entropy2(D)[2], 0)
+
+    def test_log2_3pow_m2(self):
+        # pylint: disable=protected-access
+        for k in (1., 2., 5., 32., 40.):
+            self.assertAlmostEqual(discretize._log2_3pow_m2(k),
+                                   np.log2(3 ** k - 2))
+        self.assertAlmostEqual(discretize._log2_3pow_m2(1000.),
+                               1000 * np.log2(3))
+
+    def test_entropy_cuts(self):
+        C = np.array([[3, 0], [2, 1], [0, 4], [1, 1], [0, 2]], dtype=float)
+        cumC = np.vstack((np.zeros((1, 2)), np.cumsum(C, axis=0)))
+        mdl = discretize.EntropyMDL
+        for lo, hi in ((0, 5), (1, 4), (2, 3)):
+            E, ES1, ES2 = mdl._entropy_cuts_sorted_range(cumC, lo, hi)
+            S1 = np.array([C[lo:c].sum(axis=0) for c in range(lo + 1, hi)])
+            S2 = np.array([C[c:hi].sum(axis=0) for c in range(lo + 1, hi)])
+            S1 = S1.reshape(-1, 2)
+            S2 = S2.reshape(-1, 2)
+            n1, n2 = S1.sum(axis=1), S2.sum(axis=1)
+            np.testing.assert_almost_equal(ES1, mdl._entropy2(S1))
+            np.testing.assert_almost_equal(ES2, mdl._entropy2(S2))
+            np.testing.assert_almost_equal(
+                E, (n1 * ES1 + n2 * ES2) / C[lo:hi].sum())
+
+    def test_entropy_parallel(self):
+        # Kernels run in parallel above 500 rows (PARALLEL_MIN_ROWS)
+        def entropy(D):
+            s = D.sum(axis=1, keepdims=True)
+            P = np.divide(D, s, out=np.zeros_like(D), where=s > 0)
+            logP = np.log2(P, out=np.zeros_like(P), where=P > 0)
+            return -np.sum(P * logP, axis=1)
+
+        # pylint: disable=protected-access
+        _discretize = discretize._discretize
+        rgen = np.random.RandomState(0)
+        for n in (600, 3000):
+            C = rgen.randint(0, 4, (n, 3)).astype(float)
+            np.testing.assert_allclose(
+                _discretize.entropy_counts2(C), entropy(C),
+                rtol=1e-12, atol=1e-12)
+
+            cumC = np.vstack((np.zeros((1, 3)), np.cumsum(C, axis=0)))
+            E, ES1, ES2 = _discretize.entropy_cuts(cumC, 0, n)
+            S1, S2 = cumC[1:n], cumC[n] - cumC[1:n]
+            n1, n2 = S1.sum(axis=1), S2.sum(axis=1)
+            np.testing.assert_allclose(ES1, entropy(S1),
+                                       rtol=1e-12, atol=1e-12)
+            np.testing.assert_allclose(ES2, entropy(S2),
+                                       rtol=1e-12, atol=1e-12)
+            np.testing.assert_allclose(
+                E, (n1 * ES1 + n2 * ES2) / cumC[n].sum(),
+                rtol=1e-12, atol=1e-12)
+
+
+class TestDiscretizationCache(TestCase):
+    def test_cache_per_data(self):
+        X = np.arange(100, dtype=float).reshape((100, 1))
+        Y = np.array([0] * 50 + [1] * 50)
+        table = data.Table.from_numpy(None, X, Y)
+        table2 = data.Table.from_numpy(None, X, Y)
+        for disc in (discretize.EqualFreq(n=4),
+                     discretize.EqualWidth(n=4),
+                     discretize.EntropyMDL()):
+            dvar = disc(table, table.domain[0])
+            self.assertEqual(disc(table, 0), dvar)
+            self.assertEqual(type(disc)(**disc.__dict__)(table, 0), dvar)
+            self.assertEqual(disc(table2, 0).values, dvar.values)
+
+    def test_cache_hit(self):
+        X = np.arange(100, dtype=float).reshape((100, 1))
+        table = data.Table.from_numpy(None, X)
+        disc = discretize.EqualFreq(n=4)
+        get_distribution = discretize.distribution.get_distribution
+        with patch.object(discretize.distribution, "get_distribution",
+                          wraps=get_distribution) as get_dist:
+            dvar = disc(table, 0)
+            dvar2 = disc(table, 0)
+            self.assertEqual(get_dist.call_count, 1)
+            discretize.EqualFreq(n=3)(table, 0)
+            self.assertEqual(get_dist.call_count, 2)
+        # Each call returns a new variable
+        self.assertIsNot(dvar2, dvar)
+        self.assertIsNot(dvar2.compute_value.points, dvar.compute_value.points)
+        dvar.attributes["foo"] = 42
+        dvar.compute_value.points[0] = 0
+        dvar3 = disc(table, 0)
+        self.assertNotIn("foo", dvar3.attributes)
+        np.testing.assert_equal(dvar3.compute_value.points, [24.5, 49.5, 74.5])
+
+    def test_cache_batch_table_checksum(self):
+        X = np.arange(300, dtype=float).reshape((100, 3))
+        Y = np.array([0] * 50 + [1] * 50)
+        table = data.Table.from_numpy(None, X, Y)
+        disc = discretize.EntropyMDL()
+        # pylint: disable=protected-access
+        with patch.object(discretize, "_table_checksum",
+                          wraps=discretize._table_checksum) as checksum:
+            dvars = disc.batch(table, table.domain.attributes)
+            self.assertEqual(checksum.call_count, 1)
+            disc(table, 0)
+            self.assertEqual(checksum.call_count, 2)
+        self.assertEqual([dvar.name for dvar in dvars],
+                         [attr.name for attr in table.domain.attributes])
+
+    def test_cache_data_changed(self):
+        X = np.arange(100, dtype=float).reshape((100, 1)).copy()
+        Y = np.array([0] * 50 + [1] * 50)
+        table = data.Table.from_numpy(None, X, Y)
+        disc = discretize.EntropyMDL()
+        np.testing.assert_equal(disc(table, 0).compute_value.points, [49.5])
+        with table.unlocked():
+            table.Y[75:] = 0
+        np.testing.assert_equal(disc(table, 0).compute_value.points,
+                                [49.5, 74.5])
+
+        disc = discretize.EqualWidth(n=4)
+        np.testing.assert_equal(disc(table, 0).compute_value.points,
+                                [24.75, 49.5, 74.25])
+        with table.unlocked():
+            table.X *= 10
+        np.testing.assert_equal(disc(table, 0).compute_value.points,
+                                [247.5, 495, 742.5])
+
+        disc = discretize.EqualFreq(n=2)
+        np.testing.assert_equal(disc(table, 0).compute_value.points, [495])
+        with table.unlocked():
+            table.W = np.r_[np.ones(50), np.full(50, 3.)]
+        self.assertNotEqual(disc(table, 0).compute_value.points[0], 495)
+
+    def test_cache_released_with_data(self):
+        X = np.arange(100, dtype=float).reshape((100, 1))
+        table = data.Table.from_numpy(None, X)
+        ref = weakref.ref(table)
+        discretize.EqualFreq(n=4)(table, 0)
+        del table
+        gc.collect()
+        self.assertIsNone(ref())
 
 
 # noinspection PyPep8Naming
@@ -175,7 +366,9 @@ class TestDiscretizer(TestCase):
             self.var, [1, 2, 3])
         self.assertIsInstance(dvar.compute_value,
                               discretize.Discretizer)
-        self.assertEqual(dvar.compute_value.points, [1, 2, 3])
+        np.testing.assert_equal(dvar.compute_value.points, [1, 2, 3])
+        self.assertIsInstance(dvar.compute_value.points, np.ndarray)
+        self.assertEqual(dvar.compute_value.points.dtype, np.float64)
 
 
     def test_create_discretized_var_formatting(self):
@@ -201,12 +394,53 @@ class TestDiscretizer(TestCase):
             self.var, [5, 10.1234])
         self.assertEqual(dvar.values, ("< 5", "5 - 10.1234", "≥ 10.1234"))
 
+    def test_create_discretized_var_cached_labels(self):
+        dvar1 = discretize.Discretizer.create_discretized_var(
+            self.var, [1.25, 2])
+        dvar2 = discretize.Discretizer.create_discretized_var(
+            self.var, [1.25, 2])
+        self.assertEqual(dvar1.values, dvar2.values)
+        self.assertIsNot(dvar1, dvar2)
+
+        # Labels are shared between variables with different names
+        # pylint: disable=protected-access
+        discretize._cached_interval_labels.cache_clear()
+        for name in "abc":
+            discretize.Discretizer.create_discretized_var(
+                ContinuousVariable(name, number_of_decimals=1), [1.25, 2])
+        info = discretize._cached_interval_labels.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 2))
+
+        self.var.number_of_decimals = 3
+        dvar3 = discretize.Discretizer.create_discretized_var(
+            self.var, [1.25, 2])
+        self.assertEqual(dvar3.values, ("< 1.25", "1.25 - 2", "≥ 2"))
+
+        tvar = TimeVariable("t", have_date=True)
+        dvar = discretize.Discretizer.create_discretized_var(tvar, [0])
+        self.assertEqual(dvar.values, ("< 1970-01-01", "≥ 1970-01-01"))
+
     def test_discretizer_computation(self):
         dvar = discretize.Discretizer.create_discretized_var(
             self.var, [1, 2, 3])
         X = np.array([0, 0.9, 1, 1.1, 1.9, 2, 2.5, 3, 3.5])
         np.testing.assert_equal(dvar.compute_value.transform(X), np.floor(X))
 
+    def test_discretizer_computation_nan(self):
+        for points in ([1, 2, 3], np.arange(20) / 2):
+            disc = discretize.Discretizer(self.var, points)
+            X = np.array([np.nan, -np.inf, 0, 0.5, 1, 1.1, 3, 3.5, 9.5, 10,
+                          np.inf, np.nan])
+            expected = np.digitize(X, points).astype(float)
+            expected[np.isnan(X)] = np.nan
+            # contiguous float64 column, strided column and int column
+            np.testing.assert_equal(disc.transform(X), expected)
+            np.testing.assert_equal(
+                disc.transform(np.vstack((X, X)).T[:, 0]), expected)
+            Xi = np.arange(-1, 12)
+            np.testing.assert_equal(disc.transform(Xi),
+                                    np.digitize(Xi, points))
+
     def test_discretizer_computation_sparse(self):
         dvar = discretize.Discretizer.create_discretized_var(
             self.var, [1, 2, 3])
@@ -302,19 +536,19 @@ class TestDiscretizeTable(TestCase):
     def test_discretize_exclude_constant(self):
         dom = discretize.DomainDiscretizer()(self.table_no_class)
         self.assertEqual(len(dom.attributes), 2)
-        self.assertEqual(dom[0].compute_value.points, [0.5])
-        self.assertEqual(dom[1].compute_value.points, [24.5, 49.5, 74.5])
+        np.testing.assert_equal(dom[0].compute_value.points, [0.5])
+        np.testing.assert_equal(dom[1].compute_value.points, [24.5, 49.5, 74.5])
 
         dom = discretize.DomainDiscretizer(clean=False)(self.table_no_class)
         self.assertEqual(len(dom.attributes), 3)
-        self.assertEqual(dom[0].compute_value.points, [0.5])
-        self.assertEqual(dom[1].compute_value.points, [24.5, 49.5, 74.5])
-        self.assertEqual(dom[2].compute_value.points, [])
+        np.testing.assert_equal(dom[0].compute_value.points, [0.5])
+        np.testing.assert_equal(dom[1].compute_value.points, [24.5, 49.5, 74.5])
+        np.testing.assert_equal(dom[2].compute_value.points, [])
 
         dom = discretize.DomainDiscretizer()(self.table_class)
         self.assertEqual(len(dom.attributes), 2)
-        self.assertEqual(dom[0].compute_value.points, [0.5])
-        self.assertEqual(dom[1].compute_value.points, [24.5, 49.5, 74.5])
+        np.testing.assert_equal(dom[0].compute_value.points, [0.5])
+        np.testing.assert_equal(dom[1].compute_value.points, [24.5, 49.5, 74.5])
 
     def test_discretize_class(self):
         dom = discretize.DomainDiscretizer()(self.table_class)
@@ -337,8 +571,8 @@ class TestDiscretizeTable(TestCase):
                                            fixed={"Feature 2": [1, 11]})
         dom = dom(self.table_no_class)
         self.assertEqual(len(dom.attributes), 2)
-        self.assertEqual(dom[0].compute_value.points, [0.5])
-        self.assertEqual(dom[1].compute_value.points, [6])
+        np.testing.assert_equal(dom[0].compute_value.points, [0.5])
+        np.testing.assert_equal(dom[1].compute_value.points, [6])
 
     def test_leave_discrete(self):
         s = [0] * 50 + [1] * 50
@@ -353,7 +587,7 @@ class TestDiscretizeTable(TestCase):
         table = data.Table(domain, X, X1)
         dom = discretize.DomainDiscretizer()(table)
         self.assertIs(dom[0], table.domain[0])
-        self.assertEqual(dom[1].compute_value.points, [24.5, 49.5, 74.5])
+        np.testing.assert_equal(dom[1].compute_value.points, [24.5, 49.5, 74.5])
         self.assertIs(dom[2], table.domain[2])
         self.assertIs(dom.class_var, table.domain.class_var)
 
@@ -364,10 +598,23 @@ class TestDiscretizeTable(TestCase):
         table = data.Table(domain, X, X1)
         dom = discretize.DomainDiscretizer()(table)
         self.assertIs(dom[0], table.domain[0])
-        self.assertEqual(dom[1].compute_value.points, [24.5, 49.5, 74.5])
+        np.testing.assert_equal(dom[1].compute_value.points, [24.5, 49.5, 74.5])
         self.assertIs(dom[2], table.domain[2])
         self.assertIs(dom.class_var, table.domain.class_var)
 
+    def test_all_discrete(self):
+        X = np.array([[0, 1], [1, 0]])
+        domain = data.Domain([data.DiscreteVariable("a", values="MF"),
+                              data.DiscreteVariable("b", values="AB")],
+                             data.ContinuousVariable("c"))
+        table = data.Table(domain, X, np.array([0.5, 1.5]))
+        self.assertIs(discretize.DomainDiscretizer()(table), domain)
+
+        dom = discretize.DomainDiscretizer(discretize_class=True)(table)
+        self.assertIsNot(dom, domain)
+        self.assertEqual(dom.attributes, domain.attributes)
+        self.assertTrue(dom.class_var.is_discrete)
+
 
 class TestInstanceConversion(TestCase):
     def test_single_instance(self):
@@ -359,7 +359,7 @@ class TestOWDiscretize(WidgetTest, DataMixin):
             self.assertIn("1, 2, 3", s)
             self.assertIs(dvar, var)
             s, dvar = w._discretize_var(x, VarHint(Methods.EqualWidth, (3, )))
-            self.assertEqual(dvar.compute_value.points, [5, 10])
+            np.testing.assert_equal(dvar.compute_value.points, [5, 10])
 
         finally:
             del Options[42]
@@ -425,6 +425,19 @@ else:
             self.distribution.data_files.extend(files)
 
 
+def openmp_args():
+    """
+    Return compiler and linker arguments for OpenMP on platforms whose
+    default compiler supports it. Elsewhere (e.g. Apple clang), Cython's
+    prange loops compile to serial code.
+    """
+    if sys.platform == "win32":
+        return ["/openmp"], []
+    if sys.platform.startswith("linux"):
+        return ["-fopenmp"], ["-fopenmp"]
+    return [], []
+
+
 def ext_modules():
     includes = []
     libraries = []
@@ -434,7 +447,18 @@ def ext_modules():
     if os.name == 'posix':
         libraries.append("m")
 
+    omp_compile_args, omp_link_args = openmp_args()
+
     return [
+        # Cython extensions with OpenMP; excluded from the wildcard below
+        Extension(
+            "Orange.preprocess._discretize",
+            ["Orange/preprocess/_discretize.pyx"],
+            include_dirs=includes,
+            libraries=libraries,
+            extra_compile_args=omp_compile_args,
+            extra_link_args=omp_link_args,
+        ),
         # Cython extensions. Will be automatically cythonized.
         Extension(
             "*",